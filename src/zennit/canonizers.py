@@ -17,13 +17,39 @@
 # along with this library. If not, see <https://www.gnu.org/licenses/>.
 '''Functions to produce a canonical form of models fit for LRP'''
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
+from torch.nn.utils.fusion import fuse_conv_bn_weights
 
 from .core import collect_leaves
 from .types import Linear, BatchNorm, ConvolutionTranspose
 
 
+def _compute_edge_bias(weight: torch.Tensor, shift: torch.Tensor, pad1: int, pad2: int) -> torch.Tensor:
+    '''Compute the edge bands of the bias feature map of a zero-padded convolution, by running the convolution,
+    without bias and with maximum padding, on a feature map of the same size as the convolution kernel, with values
+    given by the batch norm biases. The annotations are required for TorchScript.
+    '''
+    edge_input = shift[None, :, None, None].expand(1, weight.shape[1], weight.shape[2], weight.shape[3])
+    return torch.nn.functional.conv2d(edge_input, weight, padding=[pad1, pad2])
+
+
+try:
+    _compute_edge_bias = torch.jit.script(_compute_edge_bias)
+except Exception:
+    # scripting is an optimization only, the eager function computes the same result
+    pass
+
+
+class _CanonizationParams:
+    '''Container for the per-module state attached as ``canonization_params`` during canonization. Slot-based
+    attribute access is faster than dict lookups in the forward hooks, which run on every forward pass.
+    '''
+    __slots__ = ('center_bias', 'edge_bias', 'shape_cache', 'needs_stride', 'original_x', 'threshold', 'positive')
+
+
 class Canonizer(metaclass=ABCMeta):
     '''Canonizer Base class.
     Canonizers modify modules temporarily such that certain attribution rules can properly be applied.
@@ -89,10 +115,15 @@ class MergeBatchNorm(Canonizer):
         self.linears = linears
         self.batch_norm = batch_norm
 
-        self.linear_params = [(linear.weight.data, getattr(linear.bias, 'data', None)) for linear in linears]
+        # clone the parameters, since the merge modifies them in-place
+        self.linear_params = [
+            (linear.weight.data.clone(), linear.bias.data.clone() if linear.bias is not None else None)
+            for linear in linears
+        ]
 
         self.batch_norm_params = {
-            key: getattr(self.batch_norm, key).data for key in ('weight', 'bias', 'running_mean', 'running_var')
+            key: getattr(self.batch_norm, key).data.clone()
+            for key in ('weight', 'bias', 'running_mean', 'running_var')
         }
 
         self.batch_norm_eps = batch_norm.eps
@@ -114,6 +145,28 @@ class MergeBatchNorm(Canonizer):
 
         self.batch_norm.eps = self.batch_norm_eps
 
+    @staticmethod
+    def batch_norm_identity(batch_norm):
+        '''Check whether a batch norm module already computes (close to) the identity, as may be the case in
+        partially pre-fused models, in which case there is nothing to merge.
+
+        Parameters
+        ----------
+        batch_norm: obj:`torch.nn.Module`
+            Batch Normalization module with mandatory attributes `running_mean`, `running_var`, `weight` and `bias`.
+
+        Returns
+        -------
+        bool
+            True if the batch norm computes the identity up to numerical tolerance.
+        '''
+        return (
+            torch.allclose(batch_norm.weight, torch.ones_like(batch_norm.weight))
+            and torch.allclose(batch_norm.bias, torch.zeros_like(batch_norm.bias))
+            and torch.allclose(batch_norm.running_mean, torch.zeros_like(batch_norm.running_mean))
+            and torch.allclose(batch_norm.running_var, torch.ones_like(batch_norm.running_var))
+        )
+
     @staticmethod
     def merge_batch_norm(modules, batch_norm):
         '''Update parameters of a linear layer to additionally include a Batch Normalization operation and update the
@@ -127,32 +180,57 @@ class MergeBatchNorm(Canonizer):
             Batch Normalization module with mandatory attributes `running_mean`, `running_var`, `weight`, `bias` and
             `eps`
         '''
-        denominator = (batch_norm.running_var + batch_norm.eps) ** .5
-        scale = (batch_norm.weight / denominator)
-
-        for module in modules:
-            original_weight = module.weight.data
-            if module.bias is None:
-                module.bias = torch.nn.Parameter(
-                    torch.zeros(1, device=original_weight.device, dtype=original_weight.dtype)
-                )
-            original_bias = module.bias.data
-
-            if isinstance(module, ConvolutionTranspose):
-                index = (None, slice(None), *((None,) * (original_weight.ndim - 2)))
-            else:
-                index = (slice(None), *((None,) * (original_weight.ndim - 1)))
-
-            # merge batch_norm into linear layer
-            module.weight.data = (original_weight * scale[index])
-            module.bias.data = (original_bias - batch_norm.running_mean) * scale + batch_norm.bias
-
-        # change batch_norm parameters to produce identity
-        batch_norm.running_mean.data = torch.zeros_like(batch_norm.running_mean.data)
-        batch_norm.running_var.data = torch.ones_like(batch_norm.running_var.data)
-        batch_norm.bias.data = torch.zeros_like(batch_norm.bias.data)
-        batch_norm.weight.data = torch.ones_like(batch_norm.weight.data)
-        batch_norm.eps = 0.
+        # trivial batch norms need no merge; remove restores the identical parameters, which is a no-op
+        if MergeBatchNorm.batch_norm_identity(batch_norm):
+            return
+
+        # the arithmetic only touches parameter data, so autograd bookkeeping is skipped
+        with torch.no_grad():
+            scale = batch_norm.weight * torch.rsqrt(batch_norm.running_var + batch_norm.eps)
+
+            # broadcast views of scale, shared between transposed convolutions with the same
+            # weight layout, so merging multiple linears only reshapes once per layout
+            scale_views = {}
+            for module in modules:
+                original_weight = module.weight.data
+                if module.bias is None:
+                    module.bias = torch.nn.Parameter(
+                        torch.zeros(scale.shape[0], device=original_weight.device, dtype=original_weight.dtype)
+                    )
+
+                if isinstance(module, ConvolutionTranspose):
+                    # torch's fusion helper assumes the output-channel dimension comes first, which does
+                    # not hold for transposed convolutions, so these are merged by hand, in-place to
+                    # avoid allocating temporaries the size of the weight; register keeps clones of the
+                    # originals to restore on remove
+                    scale_view = scale_views.get(original_weight.ndim)
+                    if scale_view is None:
+                        scale_view = scale[(None, slice(None), *((None,) * (original_weight.ndim - 2)))]
+                        scale_views[original_weight.ndim] = scale_view
+                    module.weight.data.mul_(scale_view)
+                    module.bias.data.sub_(batch_norm.running_mean).mul_(scale).add_(batch_norm.bias)
+                else:
+                    # delegate the fusion arithmetic to torch's own helper, which also covers dense
+                    # layers since their output dimension likewise comes first
+                    new_weight, new_bias = fuse_conv_bn_weights(
+                        module.weight,
+                        module.bias,
+                        batch_norm.running_mean,
+                        batch_norm.running_var,
+                        batch_norm.eps,
+                        batch_norm.weight,
+                        batch_norm.bias,
+                    )
+                    module.weight.data = new_weight.data
+                    module.bias.data = new_bias.data
+
+            # change batch_norm parameters to produce identity, in-place since register keeps
+            # clones of the originals
+            batch_norm.running_mean.data.zero_()
+            batch_norm.running_var.data.fill_(1.)
+            batch_norm.bias.data.zero_()
+            batch_norm.weight.data.fill_(1.)
+            batch_norm.eps = 0.
 
 
 class SequentialMergeBatchNorm(MergeBatchNorm):
@@ -168,7 +246,7 @@ class SequentialMergeBatchNorm(MergeBatchNorm):
 
     '''
 
-    def apply(self, root_module):
+    def apply(self, root_module, leaves=None):
         '''Finds a batch norm following right after a linear layer, and creates a copy of this instance to merge
         them by fusing the batch norm parameters into the linear layer and reducing the batch norm to the identity.
 
@@ -177,21 +255,26 @@ class SequentialMergeBatchNorm(MergeBatchNorm):
         root_module: obj:`torch.nn.Module`
             A module of which the leaves will be searched and if a batch norm is found right after a linear layer, will
             be merged.
+        leaves: list of obj:`torch.nn.Module`, optional
+            Pre-collected leaves of ``root_module``, which may be shared between multiple canonizers to avoid
+            traversing the module tree more than once.
 
         Returns
         -------
         instances: list
             A list of instances of this class which modified the appropriate leaves.
         '''
+        if leaves is None:
+            leaves = collect_leaves(root_module)
         instances = []
-        last_leaf = None
-        for leaf in collect_leaves(root_module):
-            if isinstance(last_leaf, self.linear_type) and isinstance(leaf, self.batch_norm_type):
-                if last_leaf.weight.shape[0] == leaf.weight.shape[0]:
+        window = deque([None], maxlen=2)
+        for leaf in leaves:
+            window.append(leaf)
+            if isinstance(window[0], self.linear_type) and isinstance(leaf, self.batch_norm_type):
+                if window[0].weight.shape[0] == leaf.weight.shape[0]:
                     instance = self.copy()
-                    instance.register((last_leaf,), leaf)
+                    instance.register((window[0],), leaf)
                     instances.append(instance)
-            last_leaf = leaf
 
         return instances
 
@@ -211,53 +294,64 @@ class MergeBatchNormtoRight(MergeBatchNorm):
 
     @staticmethod
     def convhook(module, x, y):
-        x = x[0]
-        bias_kernel = module.canonization_params["bias_kernel"]
+        # attributes used more than once are bound to locals, since the hook runs on every forward
+        params = module.canonization_params
+        shape_cache = params.shape_cache
+        in_shape = x[0].shape
+        key = (in_shape[2], in_shape[3])
+        cached = shape_cache.get(key)
+        if cached is not None:
+            if torch.is_grad_enabled():
+                return y + cached
+            # without autograd, the fresh convolution output may be updated in-place, saving a
+            # full feature-map allocation
+            return y.add_(cached)
+
+        edge_bias = params.edge_bias
         pad1, pad2 = module.padding
         # ASSUMING module.kernel_size IS ALWAYS STRICTLY GREATER THAN module.padding
-        if pad1 > 0:
-            left_margin = bias_kernel[:, :, 0:pad1, :]
-            right_margin = bias_kernel[:, :, pad1 + 1:, :]
-            middle = bias_kernel[:, :, pad1:pad1 + 1, :].expand(
-                1,
-                bias_kernel.shape[1],
-                x.shape[2] - module.weight.shape[2] + 1,
-                bias_kernel.shape[-1]
-            )
-            bias_kernel = torch.cat((left_margin, middle, right_margin), dim=2)
-
-        if pad2 > 0:
-            left_margin = bias_kernel[:, :, :, 0:pad2]
-            right_margin = bias_kernel[:, :, :, pad2 + 1:]
-            middle = bias_kernel[:, :, :, pad2:pad2 + 1].expand(
-                1,
-                bias_kernel.shape[1],
-                bias_kernel.shape[-2],
-                x.shape[3] - module.weight.shape[3] + 1
-            )
-            bias_kernel = torch.cat((left_margin, middle, right_margin), dim=3)
-
-        if module.stride[0] > 1 or module.stride[1] > 1:
-            indices1 = [i for i in range(0, bias_kernel.shape[2]) if i % module.stride[0] == 0]
-            indices2 = [i for i in range(0, bias_kernel.shape[3]) if i % module.stride[1] == 0]
-            bias_kernel = bias_kernel[:, :, indices1, :]
-            bias_kernel = bias_kernel[:, :, :, indices2]
-        ynew = y + bias_kernel
-        return ynew
+        # the interior of the output is the constant, analytically computed center bias, while the
+        # rows and columns within padding distance of the border take their values from the edge
+        # bands of the small conv output; broadcasting in the slice assignments stretches each
+        # band's interior segment, and empty slices make bands without padding no-ops
+        kernel_shape = module.weight.shape
+        height = in_shape[2] + 2 * pad1 - kernel_shape[2] + 1
+        width = in_shape[3] + 2 * pad2 - kernel_shape[3] + 1
+        bias_kernel = params.center_bias.expand(1, y.shape[1], height, width).clone()
+        bias_kernel[:, :, :pad1, :pad2] = edge_bias[:, :, :pad1, :pad2]
+        bias_kernel[:, :, :pad1, pad2:width - pad2] = edge_bias[:, :, :pad1, pad2:pad2 + 1]
+        bias_kernel[:, :, :pad1, width - pad2:] = edge_bias[:, :, :pad1, pad2 + 1:]
+        bias_kernel[:, :, pad1:height - pad1, :pad2] = edge_bias[:, :, pad1:pad1 + 1, :pad2]
+        bias_kernel[:, :, pad1:height - pad1, width - pad2:] = edge_bias[:, :, pad1:pad1 + 1, pad2 + 1:]
+        bias_kernel[:, :, height - pad1:, :pad2] = edge_bias[:, :, pad1 + 1:, :pad2]
+        bias_kernel[:, :, height - pad1:, pad2:width - pad2] = edge_bias[:, :, pad1 + 1:, pad2:pad2 + 1]
+        bias_kernel[:, :, height - pad1:, width - pad2:] = edge_bias[:, :, pad1 + 1:, pad2 + 1:]
+
+        if params.needs_stride:
+            # basic slicing with a step produces a view, avoiding the gather kernels and intermediate
+            # allocations of advanced integer-array indexing
+            stride1, stride2 = module.stride
+            bias_kernel = bias_kernel[:, :, ::stride1, ::stride2]
+        shape_cache[key] = bias_kernel
+        if torch.is_grad_enabled():
+            return y + bias_kernel
+        return y.add_(bias_kernel)
 
     def __init__(self):
         super().__init__()
         self.handles = []
 
-    def apply(self, root_module):
+    def apply(self, root_module, leaves=None):
+        if leaves is None:
+            leaves = collect_leaves(root_module)
         instances = []
-        last_leaf = None
-        for leaf in collect_leaves(root_module):
-            if isinstance(last_leaf, self.batch_norm_type) and isinstance(leaf, self.linear_type):
+        window = deque([None], maxlen=2)
+        for leaf in leaves:
+            window.append(leaf)
+            if isinstance(window[0], self.batch_norm_type) and isinstance(leaf, self.linear_type):
                 instance = self.copy()
-                instance.register((leaf,), last_leaf)
+                instance.register((leaf,), window[0])
                 instances.append(instance)
-            last_leaf = leaf
 
         return instances
 
@@ -276,10 +370,15 @@ class MergeBatchNormtoRight(MergeBatchNorm):
         self.batch_norm = batch_norm
         self.batch_norm_eps = self.batch_norm.eps
 
-        self.linear_params = [(linear.weight.data, getattr(linear.bias, 'data', None)) for linear in linears]
+        # clone the parameters, since the merge modifies them in-place
+        self.linear_params = [
+            (linear.weight.data.clone(), linear.bias.data.clone() if linear.bias is not None else None)
+            for linear in linears
+        ]
 
         self.batch_norm_params = {
-            key: getattr(self.batch_norm, key).data for key in ('weight', 'bias', 'running_mean', 'running_var')
+            key: getattr(self.batch_norm, key).data.clone()
+            for key in ('weight', 'bias', 'running_mean', 'running_var')
         }
         returned_handles = self.merge_batch_norm(self.linears, self.batch_norm)
         if returned_handles != []:
@@ -293,64 +392,96 @@ class MergeBatchNormtoRight(MergeBatchNorm):
         for h in self.handles:
             h.remove()
         for module in self.linears:
-            if isinstance(module, torch.nn.Conv2d):
-                if module.padding != (0, 0):
-                    delattr(module, "canonization_params")
+            # skipped merges, e.g. for identity batch norms, leave no canonization_params behind
+            if isinstance(module, torch.nn.Conv2d) and hasattr(module, "canonization_params"):
+                delattr(module, "canonization_params")
 
     def merge_batch_norm(self, modules, batch_norm):
         return_handles = []
-        denominator = (batch_norm.running_var + batch_norm.eps) ** .5
-
-        # Weight of the batch norm layer when seen as an affine transformation
-        scale = (batch_norm.weight / denominator)
-
-        # bias of the batch norm layer when seen as an affine transformation
-        shift = batch_norm.bias - batch_norm.running_mean * scale
 
-        for module in modules:
-            original_weight = module.weight.data
-            if module.bias is None:
-                module.bias = torch.nn.Parameter(
-                    torch.zeros(module.out_channels, device=original_weight.device, dtype=original_weight.dtype)
-                )
-            original_bias = module.bias.data
-
-            if isinstance(module, ConvolutionTranspose):
-                index = (slice(None), *((None,) * (original_weight.ndim - 1)))
-            else:
-                index = (None, slice(None), *((None,) * (original_weight.ndim - 2)))
-
-            # merge batch_norm into linear layer to the right
-            module.weight.data = (original_weight * scale[index])
-
-            if isinstance(module, torch.nn.Conv2d):
-                if module.padding == (0, 0):
-                    module.bias.data = (original_weight * shift[index]).sum(dim=[1, 2, 3]) + original_bias
-                else:
-                    # We calculate a bias kernel, which is the output of the conv layer, without the bias, and with maximum padding,
-                    # applied to feature maps of the same size as the convolution kernel, with values given by the batch norm biases.
-                    # This produces a mostly constant feature map, which is not constant near the edges due to padding.
-                    # We then attach a forward hook to the conv layer to compute from this bias_kernel the feature map to be added
-                    # after the convolution due to the batch norm bias, depending on the given input's shape
-                    bias_kernel = shift[index].expand(*(shift[index].shape[0:-2] + original_weight.shape[-2:]))
-                    temp_module = torch.nn.Conv2d(in_channels=module.in_channels, out_channels=module.out_channels,
-                                                  kernel_size=module.kernel_size, padding=module.padding,
-                                                  padding_mode=module.padding_mode, bias=False)
-                    temp_module.weight.data = original_weight
-                    bias_kernel = temp_module(bias_kernel).detach()
-
-                    module.canonization_params = {}
-                    module.canonization_params["bias_kernel"] = bias_kernel
-                    return_handles.append(module.register_forward_hook(MergeBatchNormtoRight.convhook))
-            elif isinstance(module, torch.nn.Linear):
-                module.bias.data = (original_weight * shift).sum(dim=1) + original_bias
-
-        # change batch_norm parameters to produce identity
-        batch_norm.running_mean.data = torch.zeros_like(batch_norm.running_mean.data)
-        batch_norm.running_var.data = torch.ones_like(batch_norm.running_var.data)
-        batch_norm.bias.data = torch.zeros_like(batch_norm.bias.data)
-        batch_norm.weight.data = torch.ones_like(batch_norm.weight.data)
-        batch_norm.eps = 0.
+        # trivial batch norms need no merge; remove restores the identical parameters, which is a no-op
+        if self.batch_norm_identity(batch_norm):
+            return return_handles
+
+        # the arithmetic only touches parameter data, so autograd bookkeeping is skipped
+        with torch.no_grad():
+            # Weight of the batch norm layer when seen as an affine transformation
+            scale = batch_norm.weight * torch.rsqrt(batch_norm.running_var + batch_norm.eps)
+
+            # bias of the batch norm layer when seen as an affine transformation
+            shift = batch_norm.bias - batch_norm.running_mean * scale
+
+            # broadcast views of scale and shift, shared between modules with the same weight
+            # layout, so merging multiple linears only reshapes once per layout
+            views = {}
+            for module in modules:
+                original_weight = module.weight.data
+                if module.bias is None:
+                    module.bias = torch.nn.Parameter(
+                        torch.zeros(module.out_channels, device=original_weight.device, dtype=original_weight.dtype)
+                    )
+                layout = (isinstance(module, ConvolutionTranspose), original_weight.ndim)
+                if layout not in views:
+                    if layout[0]:
+                        index = (slice(None), *((None,) * (original_weight.ndim - 1)))
+                    else:
+                        index = (None, slice(None), *((None,) * (original_weight.ndim - 2)))
+                    views[layout] = (scale[index], shift[index])
+                scale_view, shift_view = views[layout]
+
+                # the bias updates below need the unscaled weight, so they happen before the weight is
+                # scaled in-place; register keeps clones of the originals to restore on remove
+                if isinstance(module, torch.nn.Conv2d):
+                    if module.padding == (0, 0):
+                        module.bias.data.add_((original_weight * shift_view).sum(dim=[1, 2, 3]))
+                    else:
+                        # The conv output owed to the batch norm bias is constant over the interior of the feature map,
+                        # where the kernel sees no padding: analytically, it is the kernel summed over its spatial
+                        # dimensions, contracted with the batch norm biases. Near the borders the padding truncates the
+                        # kernel, so those edge bands are computed by running the conv, without bias and with maximum
+                        # padding, on a feature map of the same size as the convolution kernel, with values given by the
+                        # batch norm biases. A forward hook on the conv layer assembles from these two parts the feature
+                        # map to be added after the convolution, depending on the given input's shape
+                        center_bias = (original_weight.sum(dim=[2, 3]) @ shift)[None, :, None, None]
+                        if module.padding_mode == 'zeros':
+                            edge_bias = _compute_edge_bias(
+                                original_weight, shift, module.padding[0], module.padding[1]
+                            )
+                        else:
+                            edge_input = shift_view.expand(
+                                *(shift_view.shape[0:-2] + original_weight.shape[-2:])
+                            )
+                            edge_bias = torch.nn.functional.conv2d(
+                                torch.nn.functional.pad(
+                                    edge_input,
+                                    (module.padding[1],) * 2 + (module.padding[0],) * 2,
+                                    mode=module.padding_mode
+                                ),
+                                original_weight
+                            )
+
+                        params = _CanonizationParams()
+                        params.center_bias = center_bias
+                        params.edge_bias = edge_bias
+                        # expanded bias kernels by input spatial shape, so repeated forwards with the same
+                        # input shape reduce to a single add; dropped along with canonization_params on remove
+                        params.shape_cache = {}
+                        params.needs_stride = module.stride[0] > 1 or module.stride[1] > 1
+                        module.canonization_params = params
+                        return_handles.append(module.register_forward_hook(MergeBatchNormtoRight.convhook))
+                elif isinstance(module, torch.nn.Linear):
+                    module.bias.data.add_((original_weight * shift).sum(dim=1))
+
+                # merge batch_norm into linear layer to the right
+                module.weight.data.mul_(scale_view)
+
+            # change batch_norm parameters to produce identity, in-place since register keeps
+            # clones of the originals
+            batch_norm.running_mean.data.zero_()
+            batch_norm.running_var.data.fill_(1.)
+            batch_norm.bias.data.zero_()
+            batch_norm.weight.data.fill_(1.)
+            batch_norm.eps = 0.
         return return_handles
 
 
@@ -361,46 +492,78 @@ class ThreshReLUMergeBatchNorm(MergeBatchNormtoRight):
 
     @staticmethod
     def prehook(module, x):
-        module.canonization_params["original_x"] = x[0].clone()
+        # an out-of-place ReLU leaves its input untouched, so keeping a reference suffices; only an
+        # in-place ReLU would overwrite the storage and requires a clone
+        if getattr(module, 'inplace', False):
+            module.canonization_params.original_x = x[0].clone()
+        else:
+            module.canonization_params.original_x = x[0]
 
     @staticmethod
     def fwdhook(module, x, y):
-        x = module.canonization_params["original_x"]
-        index = (None, slice(None), *((None,) * (module.canonization_params['weights'].ndim + 1)))
-        y = module.canonization_params['weights'][index] * x + module.canonization_params['biases'][index]
-        baseline_vals = -1. * (module.canonization_params['biases'] / module.canonization_params['weights'])[index]
-        return torch.where(y > 0, x, baseline_vals)
+        params = module.canonization_params
+        x = params.original_x
+        threshold = params.threshold
+        if params.positive is None:
+            keep = x > threshold
+        else:
+            keep = torch.where(params.positive, x > threshold, x < threshold)
+        # the replacement value below the threshold is the threshold itself
+        return torch.where(keep, x, threshold)
+
+    # integer tags for the sliding-window pattern match in apply, assigned per leaf instead of
+    # repeating isinstance checks for every window position
+    _LINEAR, _BATCH_NORM, _RELU, _POOL, _OTHER = range(5)
+    _tag_cache = {}
+
+    @classmethod
+    def _classify(cls, leaf):
+        '''Classify a leaf module into one of the integer tags, cached by module type.'''
+        tag = cls._tag_cache.get(type(leaf))
+        if tag is None:
+            if isinstance(leaf, cls.linear_type):
+                tag = cls._LINEAR
+            elif isinstance(leaf, cls.batch_norm_type):
+                tag = cls._BATCH_NORM
+            elif isinstance(leaf, torch.nn.ReLU):
+                tag = cls._RELU
+            elif isinstance(leaf, torch.nn.AdaptiveAvgPool2d):
+                tag = cls._POOL
+            else:
+                tag = cls._OTHER
+            cls._tag_cache[type(leaf)] = tag
+        return tag
 
     def __init__(self):
         super().__init__()
         self.relu = None
 
-    def apply(self, root_module):
+    def apply(self, root_module, leaves=None):
+        if leaves is None:
+            leaves = collect_leaves(root_module)
         instances = []
-        oldest_leaf = None
-        old_leaf = None
-        mid_leaf = None
-        for leaf in collect_leaves(root_module):
+        window = deque([None] * 3, maxlen=4)
+        tags = deque([self._OTHER] * 3, maxlen=4)
+        for leaf in leaves:
+            window.append(leaf)
+            tags.append(self._classify(leaf))
             if (
-                    isinstance(old_leaf, self.batch_norm_type)
-                    and isinstance(mid_leaf, ReLU)
-                    and isinstance(leaf, self.linear_type)
+                    tags[-3] == self._BATCH_NORM
+                    and tags[-2] == self._RELU
+                    and tags[-1] == self._LINEAR
             ):
                 instance = self.copy()
-                instance.register((leaf,), old_leaf, mid_leaf)
+                instance.register((leaf,), window[-3], window[-2])
                 instances.append(instance)
             elif (
-                    isinstance(oldest_leaf, self.batch_norm_type)
-                    and isinstance(old_leaf, ReLU)
-                    and isinstance(mid_leaf, AdaptiveAvgPool2d)
-                    and isinstance(leaf, self.linear_type)
+                    tags[-4] == self._BATCH_NORM
+                    and tags[-3] == self._RELU
+                    and tags[-2] == self._POOL
+                    and tags[-1] == self._LINEAR
             ):
                 instance = self.copy()
-                instance.register((leaf,), oldest_leaf, old_leaf)
+                instance.register((leaf,), window[-4], window[-3])
                 instances.append(instance)
-            oldest_leaf = old_leaf
-            old_leaf = mid_leaf
-            mid_leaf = leaf
 
         return instances
 
@@ -419,12 +582,23 @@ class ThreshReLUMergeBatchNorm(MergeBatchNormtoRight):
         '''
         self.relu = relu
 
-        denominator = (batch_norm.running_var + batch_norm.eps) ** .5
-        scale = (batch_norm.weight / denominator)  # Weight of the batch norm layer when seen as a linear layer
-        shift = batch_norm.bias - batch_norm.running_mean * scale  # bias of the batch norm layer when seen as a linear layer
-        self.relu.canonization_params = {}
-        self.relu.canonization_params['weights'] = scale
-        self.relu.canonization_params['biases'] = shift
+        # the arithmetic only reads parameter data, so autograd bookkeeping is skipped
+        with torch.no_grad():
+            # Weight of the batch norm layer when seen as a linear layer
+            scale = batch_norm.weight * torch.rsqrt(batch_norm.running_var + batch_norm.eps)
+            # bias of the batch norm layer when seen as a linear layer
+            shift = batch_norm.bias - batch_norm.running_mean * scale
+
+            # the batch norm output scale * x + shift crosses zero at x == -shift / scale per channel,
+            # which is both the threshold of the modified ReLU and its replacement value below the
+            # threshold; precomputing it leaves only a comparison and a where to the forward hook
+            index = (None, slice(None), None, None)
+            params = _CanonizationParams()
+            params.threshold = (-shift / scale)[index]
+            # for channels with negative scale, the comparison direction flips; None marks the common
+            # all-positive case, which needs no per-channel selection
+            params.positive = (scale > 0)[index] if (scale <= 0).any() else None
+            self.relu.canonization_params = params
 
         super().register(linears, batch_norm)
         self.handles.append(self.relu.register_forward_pre_hook(ThreshReLUMergeBatchNorm.prehook))
@@ -452,7 +626,9 @@ class NamedMergeBatchNorm(MergeBatchNorm):
         self.name_map = name_map
 
     def apply(self, root_module):
-        '''Create appropriate merges given by the name map.
+        '''Create appropriate merges given by the name map. Merges of disjoint module groups are independent and
+        are registered concurrently in a thread pool, since torch releases the GIL inside its kernels; groups
+        sharing modules are merged serially, as their updates would race.
 
         Parameters
         ----------
@@ -467,10 +643,28 @@ class NamedMergeBatchNorm(MergeBatchNorm):
         instances = []
         lookup = dict(root_module.named_modules())
 
+        tasks = []
         for linear_names, batch_norm_name in self.name_map:
             instance = self.copy()
-            instance.register([lookup[name] for name in linear_names], lookup[batch_norm_name])
             instances.append(instance)
+            tasks.append((instance, [lookup[name] for name in linear_names], lookup[batch_norm_name]))
+
+        seen = set()
+        disjoint = True
+        for _, linears, batch_norm in tasks:
+            module_ids = {id(module) for module in (*linears, batch_norm)}
+            if seen & module_ids:
+                disjoint = False
+                break
+            seen |= module_ids
+
+        if disjoint and len(tasks) > 1:
+            with ThreadPoolExecutor() as executor:
+                # list forces evaluation, waiting for all merges and re-raising their exceptions
+                list(executor.map(lambda task: task[0].register(task[1], task[2]), tasks))
+        else:
+            for instance, linears, batch_norm in tasks:
+                instance.register(linears, batch_norm)
 
         return instances
 
@@ -577,8 +771,15 @@ class CompositeCanonizer(Canonizer):
             The applied canonizer instances, which may be removed by calling `.remove`.
         '''
         instances = []
+        leaves = None
         for canonizer in self.canonizers:
-            instances += canonizer.apply(root_module)
+            if isinstance(canonizer, (SequentialMergeBatchNorm, MergeBatchNormtoRight)):
+                # collect the leaves once and share them between all traversing canonizers
+                if leaves is None:
+                    leaves = list(collect_leaves(root_module))
+                instances += canonizer.apply(root_module, leaves=leaves)
+            else:
+                instances += canonizer.apply(root_module)
         instances.reverse()
         return instances
 